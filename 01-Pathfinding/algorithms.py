@@ -5,50 +5,60 @@
 
 
 import heapq
+import math
 import random
 import time
 import config
 from collections import deque
+from heuristics import TILE_BITS, TILE_MASK, pack_state
 
 module_heuristic = __import__('heuristics')
 
 
+# Returns a tuple of possible moves, i.e., linearized matrix indices around the empty tile.
+def compute_neighbours(zero_tile_ind):
+    # config.N      - number of rows in the matrix.
+    # zero_tile_ind - index of the tile in the matrix where the empty tile currently is.
+    row, col = divmod(zero_tile_ind, config.N)
+    legal_actions = []
+    # If the empty tile isn't in the top row, it's possible to slide down the tile that is above it.
+    if row > 0:
+        legal_actions.append(zero_tile_ind - config.N)
+    # If the empty tile isn't in the bottom row, it's possible to slide up the tile that is below it.
+    if row < config.N - 1:
+        legal_actions.append(zero_tile_ind + config.N)
+    # If the empty tile isn't in the far right column, it's possible to slide left the tile that is next to it.
+    if col < config.N - 1:
+        legal_actions.append(zero_tile_ind + 1)
+    # If the empty tile isn't in the far left column, it's possible to slide right the tile that is next to it.
+    if col > 0:
+        legal_actions.append(zero_tile_ind - 1)
+    return tuple(legal_actions)
+
+
+# Legal moves depend only on the position of the empty tile, so they are computed once for every position.
+LEGAL_MOVES_BY_ZERO = [compute_neighbours(zero_tile_ind) for zero_tile_ind in range(config.N * config.N)]
+
+
+# Internally the algorithms work with packed integer states (see heuristics.pack_state) and keep track of
+# the index of the empty tile alongside each state, so it never has to be searched for.
 class Algorithm:
     def __init__(self, heuristic=None):
         self.heuristic = heuristic
         self.nodes_evaluated = 0
         self.nodes_generated = 0
 
-    # Returns a list of possible moves, i.e., linearized matrix indices around the empty tile.
-    def get_legal_actions(self, state):
+    # Returns a tuple of possible moves, i.e., linearized matrix indices around the empty tile.
+    def get_legal_actions(self, zero_tile_ind):
         self.nodes_evaluated += 1
-        # max_index     - number of tiles in the matrix (e.g. if the matrix is 3x3, max_index is 9).
-        # config.N      - number of rows in the matrix.
-        # zero_tile_ind - index of the tile in the matrix where the empty tile currently is.
-        max_index = len(state)
-        zero_tile_ind = state.index(0)
-        legal_actions = []
-        # If the empty tile isn't in the top row, it's possible to slide down the tile that is above it.
-        if 0 <= zero_tile_ind - config.N:
-            legal_actions.append(zero_tile_ind - config.N)
-        # If the empty tile isn't in the bottom row, it's possible to slide up the tile that is below it.
-        if (zero_tile_ind + config.N) < max_index:
-            legal_actions.append(zero_tile_ind + config.N)
-        # If the empty tile isn't in the far right column, it's possible to slide left the tile that is next to it.
-        if (zero_tile_ind + 1) % config.N:
-            legal_actions.append(zero_tile_ind + 1)
-        # If the empty tile isn't in the far left column, it's possible to slide right the tile that is next to it.
-        if zero_tile_ind % config.N:
-            legal_actions.append(zero_tile_ind - 1)
-        return legal_actions
-
-    # Returns a copy of the state array where the positions of the empty tile and its chosen neighbour are switched.
-    def apply_action(self, state, action):
+        return LEGAL_MOVES_BY_ZERO[zero_tile_ind]
+
+    # Returns a new state where the positions of the empty tile and its chosen neighbour are switched.
+    # The empty tile ends up at index action, so that is the zero index of the returned state.
+    def apply_action(self, state, zero_tile_ind, action):
         self.nodes_generated += 1
-        copy_state = list(state)
-        zero_tile_ind = state.index(0)
-        copy_state[action], copy_state[zero_tile_ind] = copy_state[zero_tile_ind], copy_state[action]
-        return tuple(copy_state)
+        tile = (state >> (TILE_BITS * action)) & TILE_MASK
+        return state ^ (tile << (TILE_BITS * action)) ^ (tile << (TILE_BITS * zero_tile_ind))
 
     # This function is overriden in the extended classes.
     def get_steps(self, initial_state, goal_state):
@@ -67,137 +77,242 @@ class Algorithm:
 # Picks randomly one of the possible moves (switches the positions of the empty tile and one of its neighbours).
 class ExampleAlgorithm(Algorithm):
     def get_steps(self, initial_state, goal_state):
-        state = initial_state
+        state = pack_state(initial_state)
+        goal_state = pack_state(goal_state)
+        zero_tile_ind = initial_state.index(0)
         solution_actions = []
         while state != goal_state:
-            legal_actions = self.get_legal_actions(state)
+            legal_actions = self.get_legal_actions(zero_tile_ind)
             action = legal_actions[random.randint(0, len(legal_actions) - 1)]
             solution_actions.append(action)
-            state = self.apply_action(state, action)
+            state = self.apply_action(state, zero_tile_ind, action)
+            zero_tile_ind = action
         return solution_actions
 
 
-class Node:
-    def __init__(self, action, state):
-        self.action = action
-        self.state = state
-        self.parent = None
+# Searches don't create node objects. Each generated node is an index into two parallel lists:
+# node_parents[node_ind] - index of the parent node (-1 for the root),
+# node_actions[node_ind] - action which led from the parent to the node.
+# Returns the actions which lead from the root to the node with the given index.
+def trace_actions(node_parents, node_actions, node_ind):
+    solution_actions = []
+    while node_parents[node_ind] != -1:
+        solution_actions.append(node_actions[node_ind])
+        node_ind = node_parents[node_ind]
+    solution_actions.reverse()
+    return solution_actions
 
 
 class BFSAlgorithm(Algorithm):
     def get_steps(self, initial_state, goal_state):
-        root = Node(-1, initial_state)
-        node = root
-        queue = deque([root])
-        visited_set = set()
+        state = pack_state(initial_state)
+        goal_state = pack_state(goal_state)
+        node_parents = [-1]
+        node_actions = [-1]
+        node_ind = 0
+        # Queue entries are (state, zero index, node index).
+        queue = deque([(state, initial_state.index(0), node_ind)])
+        # States are marked as visited when they are enqueued, so each state is put in the queue only once.
+        visited_set = {state}
 
-        while node.state != goal_state:
-            node = queue.popleft()
-            state = node.state
+        while state != goal_state:
+            state, zero_tile_ind, node_ind = queue.popleft()
 
-            if state in visited_set:
-                continue
-            visited_set.add(state)
+            for action in self.get_legal_actions(zero_tile_ind):
+                new_state = self.apply_action(state, zero_tile_ind, action)
+                if new_state in visited_set:
+                    continue
+                visited_set.add(new_state)
+
+                queue.append((new_state, action, len(node_parents)))
+                node_parents.append(node_ind)
+                node_actions.append(action)
 
-            for action in self.get_legal_actions(state):
-                new_state = self.apply_action(state, action)
-                new_node = Node(action, new_state)
-                new_node.parent = node
-                queue.append(new_node)
+        return trace_actions(node_parents, node_actions, node_ind)
+
+
+# Runs BFS from the initial and from the goal state at the same time, expanding the smaller frontier one layer
+# at a time, until the two searches meet. Moves are reversible, so the backward search uses the same legal actions.
+class BidirectionalBFSAlgorithm(Algorithm):
+    def get_steps(self, initial_state, goal_state):
+        start = pack_state(initial_state)
+        goal = pack_state(goal_state)
+        if start == goal:
+            return []
+
+        # Both dicts map a reached state to (its neighbour one step closer to where that search began, action).
+        # Forward search: action leads from the neighbour to the state.
+        # Backward search: action leads from the state to the neighbour.
+        fwd_parents = {start: (None, -1)}
+        bwd_parents = {goal: (None, -1)}
+        fwd_frontier = [(start, initial_state.index(0))]
+        bwd_frontier = [(goal, goal_state.index(0))]
+        meeting_state = None
+
+        while meeting_state is None:
+            # If one of the searches ran out of states before meeting the other one, the goal can't be reached
+            # from the initial state. An empty frontier would otherwise be picked as the smaller one forever.
+            if not fwd_frontier or not bwd_frontier:
+                return None
+            if len(fwd_frontier) <= len(bwd_frontier):
+                fwd_frontier, meeting_state = self.expand_layer(fwd_frontier, fwd_parents, bwd_parents, True)
+            else:
+                bwd_frontier, meeting_state = self.expand_layer(bwd_frontier, bwd_parents, fwd_parents, False)
 
         solution_actions = []
-        while node != root:
-            solution_actions.append(node.action)
-            node = node.parent
+        state, action = fwd_parents[meeting_state]
+        while state is not None:
+            solution_actions.append(action)
+            state, action = fwd_parents[state]
         solution_actions.reverse()
-        return solution_actions
-
 
-class NodeBF(Node):
-    def __init__(self, action, state):
-        super().__init__(action, state)
-        self.predecessors = set()
-        self.heuristic = None
+        state = meeting_state
+        while state != goal:
+            state, action = bwd_parents[state]
+            solution_actions.append(action)
+        return solution_actions
 
-    # Overrides the lt operator for Node objects so that they can be compatible with the heap data structure.
-    def __lt__(self, other):
-        return self.heuristic < other.heuristic or \
-            self.heuristic == other.heuristic and self.state < other.state
+    # Generates the next layer of one of the searches. Returns the new frontier and the state in which
+    # the two searches met (None if they haven't met yet).
+    # Layers are expanded whole, so the first state found in the other search lies on a shortest path.
+    def expand_layer(self, frontier, parents, other_parents, forward):
+        new_frontier = []
+        for state, zero_tile_ind in frontier:
+            for action in self.get_legal_actions(zero_tile_ind):
+                new_state = self.apply_action(state, zero_tile_ind, action)
+                if new_state in parents:
+                    continue
+                # Going back from new_state to state slides the tile at index action into index zero_tile_ind,
+                # i.e., in the goal's direction the action is the current zero index.
+                parents[new_state] = (state, action if forward else zero_tile_ind)
+                if new_state in other_parents:
+                    return new_frontier, new_state
+                new_frontier.append((new_state, action))
+        return new_frontier, None
 
 
 class BestFirstAlgorithm(Algorithm):
     def get_steps(self, initial_state, goal_state):
-        root = NodeBF(-1, initial_state)
-        node = root
-        lst = [root]
-        heapq.heapify(lst)
-
-        while node.state != goal_state:
-            node = heapq.heappop(lst)
-            state = node.state
-
-            for action in self.get_legal_actions(state):
-                new_state = self.apply_action(state, action)
-                if new_state in node.predecessors:
-                    continue
+        state = pack_state(initial_state)
+        goal_state = pack_state(goal_state)
+        node_parents = [-1]
+        node_actions = [-1]
+        node_ind = 0
+        # Heap entries are plain tuples (heuristic, node index, state, zero index), so they are compared in C.
+        # Node indices are unique and break ties in the order in which the nodes were generated.
+        lst = [(self.heuristic.get_evaluation(state), 0, state, initial_state.index(0))]
+        # States which were already expanded, shared by the whole search instead of being copied into every node.
+        expanded_set = set()
 
-                new_node = NodeBF(action, new_state)
-                new_node.heuristic = self.heuristic.get_evaluation(new_state)
-                new_node.parent = node
-                new_node.predecessors = node.predecessors
-                new_node.predecessors.add(node.state)
-                heapq.heappush(lst, new_node)
+        while state != goal_state:
+            heuristic, node_ind, state, zero_tile_ind = heapq.heappop(lst)
 
-        solution_actions = []
-        while node != root:
-            solution_actions.append(node.action)
-            node = node.parent
-        solution_actions.reverse()
-        return solution_actions
+            if state in expanded_set:
+                continue
+            expanded_set.add(state)
 
+            for action in self.get_legal_actions(zero_tile_ind):
+                new_state = self.apply_action(state, zero_tile_ind, action)
+                if new_state in expanded_set:
+                    continue
 
-class NodeAStar(Node):
-    def __init__(self, action, state):
-        super().__init__(action, state)
-        self.predecessors = set()
-        self.heuristic = None
-        self.cumulated_cost = 0
+                tile = (state >> (TILE_BITS * action)) & TILE_MASK
+                new_heuristic = heuristic + self.heuristic.get_move_delta(tile, action, zero_tile_ind)
+                heapq.heappush(lst, (new_heuristic, len(node_parents), new_state, action))
+                node_parents.append(node_ind)
+                node_actions.append(action)
 
-    # Overrides the lt operator for Node objects so that they can be compatible with the heap data structure.
-    def __lt__(self, other):
-        return self.cumulated_cost < other.cumulated_cost or \
-            self.cumulated_cost == other.cumulated_cost and self.state < other.state
+        return trace_actions(node_parents, node_actions, node_ind)
 
 
 class AStarAlgorithm(Algorithm):
     def get_steps(self, initial_state, goal_state):
-        root = NodeAStar(-1, initial_state)
-        node = root
-        node.heuristic = 0
-        lst = [root]
-        heapq.heapify(lst)
+        state = pack_state(initial_state)
+        goal_state = pack_state(goal_state)
+        node_parents = [-1]
+        node_actions = [-1]
+        node_ind = 0
+        # Heap entries are plain tuples (cumulated cost, negated cost so far, node index, state, zero index).
+        # Among nodes with the same cumulated cost the deepest one is expanded first, since it's closest to the goal.
+        lst = [(self.heuristic.get_evaluation(state), 0, 0, state, initial_state.index(0))]
+        # The lowest cost so far with which each state was reached. Worse paths to a state are never pushed,
+        # and heap entries which were superseded by a cheaper path are skipped when popped.
+        best_costs = {state: 0}
         cost = 1
 
-        while node.state != goal_state:
-            node = heapq.heappop(lst)
-            state = node.state
+        while state != goal_state:
+            cumulated_cost, neg_path_cost, node_ind, state, zero_tile_ind = heapq.heappop(lst)
 
-            for action in self.get_legal_actions(state):
-                new_state = self.apply_action(state, action)
-                if new_state in node.predecessors:
+            path_cost = -neg_path_cost
+            if path_cost > best_costs[state]:
+                continue
+
+            heuristic = cumulated_cost - path_cost
+            for action in self.get_legal_actions(zero_tile_ind):
+                new_state = self.apply_action(state, zero_tile_ind, action)
+                new_path_cost = path_cost + cost
+                if new_path_cost >= best_costs.get(new_state, math.inf):
                     continue
+                best_costs[new_state] = new_path_cost
+
+                tile = (state >> (TILE_BITS * action)) & TILE_MASK
+                new_heuristic = heuristic + self.heuristic.get_move_delta(tile, action, zero_tile_ind)
+                heapq.heappush(lst, (new_path_cost + new_heuristic, -new_path_cost, len(node_parents),
+                                     new_state, action))
+                node_parents.append(node_ind)
+                node_actions.append(action)
 
-                new_node = NodeAStar(action, new_state)
-                new_node.heuristic = self.heuristic.get_evaluation(new_state)
-                new_node.cumulated_cost = node.cumulated_cost - node.heuristic + cost + new_node.heuristic
-                new_node.parent = node
-                new_node.predecessors = node.predecessors
-                new_node.predecessors.add(node.state)
-                heapq.heappush(lst, new_node)
+        return trace_actions(node_parents, node_actions, node_ind)
 
+
+# Iterative deepening A*: repeated depth-first searches which cut off every path whose cumulated cost exceeds
+# the bound. The first bound is the heuristic of the initial state, each following one is the smallest
+# cumulated cost which exceeded the previous bound. Only the current path is kept in memory.
+class IDAStarAlgorithm(Algorithm):
+    def get_steps(self, initial_state, goal_state):
+        state = pack_state(initial_state)
+        zero_tile_ind = initial_state.index(0)
+        goal_state = pack_state(goal_state)
+        heuristic = self.heuristic.get_evaluation(state)
+        bound = heuristic
+        # States on the current path, so that the search never walks in a cycle.
+        path_set = {state}
         solution_actions = []
-        while node != root:
-            solution_actions.append(node.action)
-            node = node.parent
-        solution_actions.reverse()
-        return solution_actions
+
+        while True:
+            bound = self.search(state, zero_tile_ind, 0, heuristic, bound, goal_state,
+                                path_set, solution_actions)
+            if bound is None:
+                return solution_actions
+            # No path exceeded the bound, so every reachable state was already searched and the goal isn't one of them.
+            if bound == math.inf:
+                return None
+
+    # Returns None if the goal was found (solution_actions then holds the path to it),
+    # otherwise returns the smallest cumulated cost which exceeded the bound.
+    def search(self, state, zero_tile_ind, path_cost, heuristic, bound, goal_state, path_set, solution_actions):
+        cumulated_cost = path_cost + heuristic
+        if cumulated_cost > bound:
+            return cumulated_cost
+        if state == goal_state:
+            return None
+        cost = 1
+
+        next_bound = math.inf
+        for action in self.get_legal_actions(zero_tile_ind):
+            new_state = self.apply_action(state, zero_tile_ind, action)
+            if new_state in path_set:
+                continue
+
+            tile = (state >> (TILE_BITS * action)) & TILE_MASK
+            new_heuristic = heuristic + self.heuristic.get_move_delta(tile, action, zero_tile_ind)
+            path_set.add(new_state)
+            solution_actions.append(action)
+            result = self.search(new_state, action, path_cost + cost, new_heuristic, bound, goal_state,
+                                 path_set, solution_actions)
+            if result is None:
+                return None
+            solution_actions.pop()
+            path_set.remove(new_state)
+            next_bound = min(next_bound, result)
+        return next_bound
@@ -1,38 +1,84 @@
 import config
 
 
+# States are packed into a single integer where each tile occupies TILE_BITS bits:
+# bits [0, TILE_BITS) hold state[0], bits [TILE_BITS, 2*TILE_BITS) hold state[1]...
+# The width is just enough for the biggest tile number, but at least four bits (enough for puzzles up to 4x4).
+TILE_BITS = max(4, (config.N * config.N - 1).bit_length())
+TILE_MASK = (1 << TILE_BITS) - 1
+
+
+# Converts a tuple state (as given by the game) into its packed integer representation.
+def pack_state(state):
+    return sum(tile << (TILE_BITS * order) for order, tile in enumerate(state))
+
+
+# TABLE[tile][order] is the contribution of the tile to the heuristic when it's at index order.
+# The empty tile (row 0) never contributes.
+HAMMING_TABLE = [[0] * (config.N * config.N)] + \
+                [[int(tile-1 != order) for order in range(config.N * config.N)]
+                 for tile in range(1, config.N * config.N)]
+MANHATTAN_TABLE = [[0] * (config.N * config.N)] + \
+                  [[abs((tile-1) // config.N - order // config.N) + abs((tile-1) % config.N - order % config.N)
+                    for order in range(config.N * config.N)]
+                   for tile in range(1, config.N * config.N)]
+
+
 class Heuristic:
     def get_evaluation(self, state):
         pass
 
+    # Returns how the evaluation changes when the tile slides from index from_ind to index to_ind.
+    # A move changes the position of only one tile, so successors don't need a full evaluation.
+    def get_move_delta(self, tile, from_ind, to_ind):
+        pass
+
 
 class ExampleHeuristic(Heuristic):
     def get_evaluation(self, state):
         return 0
 
+    def get_move_delta(self, tile, from_ind, to_ind):
+        return 0
+
+
+# The evaluation loops are free functions which get the matrix size as arguments,
+# so the per-tile work doesn't have to look up config.N or any instance attributes.
+def hamming_packed(state, n2):
+    heuristic = 0
+    for order in range(n2):
+        tile = state & TILE_MASK
+        if tile != 0 and (tile-1) != order:
+            heuristic += 1
+        state >>= TILE_BITS
+    return heuristic
+
+
+def manhattan_packed(state, n, n2):
+    heuristic = 0
+    for order in range(n2):
+        tile = state & TILE_MASK
+        if tile != 0 and (tile-1) != order:
+            goal = tile - 1
+            heuristic += abs(goal // n - order // n) + abs(goal % n - order % n)
+        state >>= TILE_BITS
+    return heuristic
+
 
 # Returns the number of tiles which are not in their goal position.
 class HammingHeuristic(Heuristic):
     def get_evaluation(self, state):
-        order = 0
-        heuristic = 0
-        for tile in state:
-            if tile != 0 and (tile-1) != order:
-                heuristic += 1
-            order += 1
-        return heuristic
+        return hamming_packed(state, config.N * config.N)
+
+    def get_move_delta(self, tile, from_ind, to_ind):
+        return HAMMING_TABLE[tile][to_ind] - HAMMING_TABLE[tile][from_ind]
 
 
 # Measures for each tile (except the empty tile) how far it is from its goal position.
 # Returns the sum of all 8 measurements.
 class ManhattanHeuristic(Heuristic):
     def get_evaluation(self, state):
-        order = 0
-        heuristic = 0
-        for tile in state:
-            if tile != 0 and (tile-1) != order:
-                row_mov = abs((tile-1) // config.N - order // config.N)
-                col_mov = abs((tile-1) % config.N - order % config.N)
-                heuristic += row_mov + col_mov
-            order += 1
-        return heuristic
+        return manhattan_packed(state, config.N, config.N * config.N)
+
+    def get_move_delta(self, tile, from_ind, to_ind):
+        return MANHATTAN_TABLE[tile][to_ind] - MANHATTAN_TABLE[tile][from_ind]
@@ -18,6 +18,7 @@ R Y _ R _ Y _    1 1 0 1 0 1 0    1 0 0 1 0 0 0    0 1 0 0 0 1 0
 """
 import random
 import time
+import config
 from state import State
 import math
 
@@ -26,6 +27,46 @@ max_depth = None    # How many moves ahead the AI will think (given as a command
 max_player = None   # The player whose move it is will be the MAX player in the algorithms.
 min_player = None   # The other player will be the MIN player.
 
+# Transposition table: maps a position to (remaining depth, score, flag) from the last time it was searched.
+# The same position is often reached through different orders of moves, so its score can be reused.
+# Scores depend on which player is MAX, so the table is cleared before every chosen move.
+transposition_table = {}
+EXACT = 0           # The stored score is the exact value of the position.
+LOWER_BOUND = 1     # The search was cut off, the value of the position is at least the stored score.
+UPPER_BOUND = 2     # No move beat alpha, the value of the position is at most the stored score.
+
+# Move ordering, both are reset before every chosen move:
+# killers[depth]  - the last two columns which caused a cutoff at the given depth (most recent first).
+# history[player] - for every column, how many (and how deep) cutoffs it caused when played by the player.
+killers = {}
+history = {}
+
+
+# State.win_masks is a list of 42b values.
+# Each value consists of only zeroes except for the four ones which represent the four winning tokens.
+# List consists all possible winning positions in the game regardless of the current state.
+# The four bits of a mask are evenly spaced (1 apart for vertical lines, 6 for horizontal, 7 and 5 for diagonals),
+# so the masks are regrouped into {spacing: 42b value with the lowest bit of every line with that spacing}.
+def group_win_masks():
+    line_starts = {}
+    for mask in State.win_masks:
+        first = mask & -mask
+        second = (mask ^ first) & -(mask ^ first)
+        shift = second.bit_length() - first.bit_length()
+        line_starts[shift] = line_starts.get(shift, 0) | first
+    return line_starts
+
+
+WIN_LINE_STARTS = group_win_masks()
+
+# MASKS_BY_CELL[cell] - all winning masks which contain the given cell (at most 13 of them).
+MASKS_BY_CELL = [[mask for mask in State.win_masks if mask & (1 << cell)] for cell in range(42)]
+
+# COLUMN_MASKS[col] - all six cells of the column, BOTTOM_CELLS[col] - the lowest cell of the column.
+COLUMN_MASKS = [0b111111 << (6 * col) for col in range(7)]
+BOTTOM_CELLS = [1 << (6 * col) for col in range(7)]
+FULL_TABLE = (1 << 42) - 1
+
 
 # Agents are AI algorithms which can be picked as players through the command line arguments.
 class Agent:
@@ -45,11 +86,12 @@ class Human(Agent):
 
 
 # An AI which just plays a random move.
+# It only pauses before the move (to look like it's thinking) if config.ANIMATE_RANDOM_AGENT is set.
 class ExampleAgent(Agent):
     def get_chosen_column(self, state, depth):
-        time.sleep(random.random())
-        columns = state.get_possible_columns()
-        return columns[random.randint(0, len(columns) - 1)]
+        if getattr(config, 'ANIMATE_RANDOM_AGENT', False):
+            time.sleep(random.random())
+        return random.choice(state.get_possible_columns())
 
 
 # An AI which uses Minimax algorithm with alpha-beta pruning.
@@ -60,7 +102,8 @@ class MinimaxABAgent(Agent):
         min_player = State.RED if max_player == State.YEL else State.YEL
         max_depth = depth if depth != 0 else math.inf
 
-        root = Node(state, -1)
+        reset_search_tables()
+        root = create_root(state)
         minimax_ab(root, max_player, -math.inf, math.inf, 0)
 
         chosen_col = root.chosen_succ
@@ -75,7 +118,8 @@ class Negascout(Agent):
         min_player = State.RED if max_player == State.YEL else State.YEL
         max_depth = depth if depth != 0 else math.inf
 
-        root = Node(state, -1)
+        reset_search_tables()
+        root = create_root(state)
         negascout(root, max_player, -math.inf, math.inf, 0)
 
         chosen_col = root.chosen_succ
@@ -85,46 +129,79 @@ class Negascout(Agent):
 
 
 # A node in the game tree we are creating consists of the following values:
-# - game's current state (layout of the played tokens).
+# - game's current state, given as the MAX and the MIN player's checkers (42b values, laid out as in State).
 # - id of the column which was selected in order to reach the current state from the previous one.
 # - id of the next column which will be picked (this attribute will be set later by the node's child).
+# - numbers of possible wins and possible losses of the MAX player (see node_evaluation).
+# - the winner, State.DRAW, or None if the game hasn't ended yet (same values as State.get_state_status returns).
+# The search doesn't use State objects, successors are generated directly on the checkers (see get_sorted_children).
 class Node:
-    def __init__(self, state, col):
-        self.state = state
+    def __init__(self, max_tokens, min_tokens, col, open_lines, status):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
         self.col = col
         self.chosen_succ = None
+        self.open_lines = open_lines
+        self.status = status
+
+
+# Creates the root of the game tree from the game's state.
+def create_root(state):
+    max_tokens = state.get_checkers(max_player)
+    min_tokens = state.get_checkers(min_player)
+    return Node(max_tokens, min_tokens, -1, get_open_lines(max_tokens, min_tokens), get_status(max_tokens, min_tokens))
 
 
 # Evaluates how good the current state is for the MAX Player by counting all possible wins and losses.
 # Possible improvement for the future: don't count all possible wins and losses equally, give advantage to
 #                                      victories which can be reached sooner and to postponed losses.
-def node_evaluation(state):
-    status = state.get_state_status()
+# The numbers of possible wins and losses are updated incrementally from the parent node (see update_open_lines).
+def node_evaluation(node):
+    status = node.status
     # MAX Player won (count_tokens used in order to give higher priority to the wins with fewer tokens used)
     if status == max_player:
-        return 1000 - count_tokens(state.get_checkers(max_player))
+        return 1000 - count_tokens(node.max_tokens)
     # MIN Player won (count_tokens used in order to give higher priority to the wins with fewer tokens used)
     elif status == min_player:
-        return -1000 + count_tokens(state.get_checkers(min_player))
+        return -1000 + count_tokens(node.min_tokens)
     elif status == State.DRAW:
         return 0
 
-    max_player_tokens = state.get_checkers(max_player)
-    min_player_tokens = state.get_checkers(min_player)
-    max_wins_cnt = 0
-    max_losses_cnt = 0
-
-    # State.win_masks is a list of 42b values.
-    # Each value consists of only zeroes except for the four ones which represent the four winning tokens.
-    # List consists all possible winning positions in the game regardless of the current state.
-    for mask in State.win_masks:
-        if (mask & min_player_tokens) == 0:
-            max_wins_cnt += 1   # It's still possible for the MAX Player to win this way.
-        if (mask & max_player_tokens) == 0:
-            max_losses_cnt += 1
+    max_wins_cnt, max_losses_cnt = node.open_lines
     return max_wins_cnt - max_losses_cnt
 
 
+# Returns (number of possible wins, number of possible losses) of the MAX player, counted on the whole table.
+# Wins which are still possible for the MAX Player are the winning lines without any MIN Player's tokens.
+def get_open_lines(max_tokens, min_tokens):
+    return count_open_lines(min_tokens), count_open_lines(max_tokens)
+
+
+# Returns the open_lines of a child state, given those of its parent state, the player's tokens in the parent state
+# and the cell where the player's token was just placed. Only the winning lines through that cell can change:
+# the ones which didn't contain any of the player's tokens until now are no longer possible for the other player.
+def update_open_lines(open_lines, player_tokens, cell, player):
+    max_wins_cnt, max_losses_cnt = open_lines
+    closed_cnt = 0
+    for mask in MASKS_BY_CELL[cell]:
+        if (mask & player_tokens) == 0:
+            closed_cnt += 1
+    if player == max_player:
+        return max_wins_cnt, max_losses_cnt - closed_cnt
+    return max_wins_cnt - closed_cnt, max_losses_cnt
+
+
+# Counts the winning lines which don't contain any of the given tokens.
+# Instead of testing the masks one by one, all lines of one direction are tested at once:
+# a line starting at bit p is open if bits p, p+shift, p+2*shift and p+3*shift are all free.
+def count_open_lines(tokens):
+    free = ~tokens
+    cnt = 0
+    for shift, starts in WIN_LINE_STARTS.items():
+        cnt += (starts & free & (free >> shift) & (free >> 2*shift) & (free >> 3*shift)).bit_count()
+    return cnt
+
+
 # Columns closer to the middle of the table are given a bigger priority (it's an advantage to control the middle).
 def col_priority(column):
     arr = [1, 3, 5, 6, 4, 2, 0]
@@ -133,85 +210,194 @@ def col_priority(column):
 
 # Counts how many tokens the selected player has already placed.
 def count_tokens(checkers):
-    cnt = 0
-    mask = 1
-    for i in range(42):
-        if (checkers & mask) != 0:
-            cnt += 1
-        mask <<= 1
-    return cnt
+    return checkers.bit_count()
+
+
+def reset_search_tables():
+    transposition_table.clear()
+    killers.clear()
+    history.clear()
+    history[State.RED] = [0] * 7
+    history[State.YEL] = [0] * 7
+
+
+# Remembers the column which caused a cutoff, so that it's tried earlier in the rest of the search.
+# Cutoffs closer to the root prune bigger subtrees, so they weigh more in the history.
+# Without a depth limit there is no remaining depth to weigh by, so every cutoff counts the same.
+def record_cutoff(player, col, depth):
+    depth_killers = killers.setdefault(depth, [-1, -1])
+    if depth_killers[0] != col:
+        depth_killers.insert(0, col)
+        depth_killers.pop()
+    history[player][col] += (max_depth - depth) ** 2 if max_depth != math.inf else 1
+
+
+# Both players' checkers packed into a single integer, used as the key in the transposition table.
+def get_state_key(node):
+    return (node.max_tokens << 42) | node.min_tokens
+
+
+# Checks whether the tokens contain a winning line, testing all lines of one direction at once.
+# pairs has a bit p set if bits p and p+shift are both set, so pairs & (pairs >> 2*shift) marks four in a row.
+# Masking with the lines' lowest bits discards the "lines" which would wrap around the edge of the table.
+def has_win(tokens):
+    for shift, starts in WIN_LINE_STARTS.items():
+        pairs = tokens & (tokens >> shift)
+        if starts & pairs & (pairs >> 2*shift):
+            return True
+    return False
+
+
+# Same values as State.get_state_status returns, computed from the checkers.
+def get_status(max_tokens, min_tokens):
+    if has_win(max_tokens):
+        return max_player
+    if has_win(min_tokens):
+        return min_player
+    if (max_tokens | min_tokens) == FULL_TABLE:
+        return State.DRAW
+    return None
+
+
+# Returns the stored score of the position if it was already searched at least as deep
+# and the score is exact or lies outside of the (alpha, beta) window. Otherwise returns None.
+def lookup_score(key, alpha, beta, remaining_depth):
+    entry = transposition_table.get(key)
+    if entry is None or entry[0] < remaining_depth:
+        return None
+    _, score, flag = entry
+    if flag == EXACT or (flag == LOWER_BOUND and score >= beta) or (flag == UPPER_BOUND and score <= alpha):
+        return score
+    return None
 
 
-# Returns None if the game hasn't ended yet.
-def is_terminal_node(state):
-    return state.get_state_status() is not None
+def store_score(key, score, alpha, beta, remaining_depth):
+    if score <= alpha:
+        flag = UPPER_BOUND
+    elif score >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    transposition_table[key] = (remaining_depth, score, flag)
+
+
+# Returns False if the game hasn't ended yet.
+def is_terminal_node(node):
+    return node.status is not None
+
+
+# Returns all the node's direct children (as Node objects), where player is the one on the move.
+# Children are visited in the order of how likely they are to cause a cutoff, so the chances of pruning are higher:
+# the killer columns of this depth go first, then the columns with the best history, then the middle columns.
+# The children aren't evaluated for that, evaluation is done only in the leaves.
+def get_sorted_children(node, player, depth):
+    depth_killers = killers.get(depth, (-1, -1))
+    player_history = history[player]
+    children = []
+    occupied = node.max_tokens | node.min_tokens
+    player_tokens = node.max_tokens if player == max_player else node.min_tokens
+    for col in range(7):
+        # Tokens in a column are stacked from its bottom cell, so adding the bottom cell to them
+        # carries over into the lowest empty cell. If the column is full, the carry leaves the column.
+        move = (occupied + BOTTOM_CELLS[col]) & COLUMN_MASKS[col]
+        if move == 0:
+            continue
+        cell = move.bit_length() - 1
+        child_tokens = player_tokens | move
+
+        if has_win(child_tokens):
+            status = player
+        elif (occupied | move) == FULL_TABLE:
+            status = State.DRAW
+        else:
+            status = None
+        child_open_lines = update_open_lines(node.open_lines, player_tokens, cell, player)
+        if player == max_player:
+            child = Node(child_tokens, node.min_tokens, col, child_open_lines, status)
+        else:
+            child = Node(node.max_tokens, child_tokens, col, child_open_lines, status)
+        killer_rank = 2 if col == depth_killers[0] else 1 if col == depth_killers[1] else 0
+        children.append((killer_rank, player_history[col], col_priority(col), child))
+    children.sort(key=lambda entry: (entry[0], entry[1], entry[2]), reverse=True)
+    return [child for _, _, _, child in children]
 
 
 # Minimax algorithm with alpha-beta pruning.
 def minimax_ab(node, player, alpha, beta, depth):
-    if is_terminal_node(node.state) or depth == max_depth:
-        return node_evaluation(node.state)
+    if is_terminal_node(node) or depth == max_depth:
+        return node_evaluation(node)
+
+    # The root is always searched, since its chosen_succ has to be set.
+    key = get_state_key(node)
+    if depth > 0:
+        score = lookup_score(key, alpha, beta, max_depth - depth)
+        if score is not None:
+            return score
+    alpha_orig, beta_orig = alpha, beta
 
-    # Node's direct children will be visited in the ascending order of their evaluations.
-    # Thus, the chances of pruning are higher.
-    sorted_cols = sorted(node.state.get_possible_columns(),
-                         key=lambda column: (node_evaluation(node.state.generate_successor_state(column)),
-                                             col_priority(column)), reverse=True)
+    children = get_sorted_children(node, player, depth)
 
     if player == max_player:
         score = -math.inf
-        for col in sorted_cols:
-            child_state = node.state.generate_successor_state(col)
-            child_score = minimax_ab(Node(child_state, col), min_player, alpha, beta, depth + 1)
+        for child in children:
+            child_score = minimax_ab(child, min_player, alpha, beta, depth + 1)
             if child_score > score:
                 score = child_score
                 alpha = score
-                node.chosen_succ = col
+                node.chosen_succ = child.col
             if alpha >= beta:
+                record_cutoff(player, child.col, depth)
                 break
+        store_score(key, score, alpha_orig, beta_orig, max_depth - depth)
         return score
     else:
         score = +math.inf
-        for col in sorted_cols:
-            child_state = node.state.generate_successor_state(col)
-            child_score = minimax_ab(Node(child_state, col), max_player, alpha, beta, depth + 1)
+        for child in children:
+            child_score = minimax_ab(child, max_player, alpha, beta, depth + 1)
             if child_score < score:
                 score = child_score
                 beta = score
-                node.chosen_succ = col
+                node.chosen_succ = child.col
             if alpha >= beta:
+                record_cutoff(player, child.col, depth)
                 break
+        store_score(key, score, alpha_orig, beta_orig, max_depth - depth)
         return score
 
 
 # NegaScout algorithm.
 def negascout(node, player, alpha, beta, depth):
-    if is_terminal_node(node.state) or depth == max_depth:
-        return node_evaluation(node.state) * (-1 if player == min_player else 1)
+    if is_terminal_node(node) or depth == max_depth:
+        return node_evaluation(node) * (-1 if player == min_player else 1)
+
+    key = get_state_key(node)
+    if depth > 0:
+        score = lookup_score(key, alpha, beta, max_depth - depth)
+        if score is not None:
+            return score
+    alpha_orig = alpha
     other_player = max_player if player == min_player else min_player
 
-    sorted_cols = sorted(node.state.get_possible_columns(),
-                         key=lambda column: (node_evaluation(node.state.generate_successor_state(column)),
-                                             col_priority(column)), reverse=True)
+    children = get_sorted_children(node, player, depth)
 
     score = -math.inf
-    for col in sorted_cols:
+    for child in children:
         # Assume that the first child will lead to the best path.
-        if col == sorted_cols[0]:
-            child_state = node.state.generate_successor_state(col)
-            child_score = -negascout(Node(child_state, col), other_player, -beta, -alpha, depth + 1)
-            node.chosen_succ = col
+        if child is children[0]:
+            child_score = -negascout(child, other_player, -beta, -alpha, depth + 1)
+            node.chosen_succ = child.col
         else:
             # For other children use the null alpha-beta window.
-            child_state = node.state.generate_successor_state(col)
-            child_score = -negascout(Node(child_state, col), other_player, -alpha - 1, -alpha, depth + 1)
+            child_score = -negascout(child, other_player, -alpha - 1, -alpha, depth + 1)
             # If another child leads to a better path, traverse its subtree again but this time using the full window.
             if alpha < child_score < beta:
-                child_score = -negascout(Node(child_state, col), other_player, -beta, -alpha, depth + 1)
-                node.chosen_succ = col
+                child_score = -negascout(child, other_player, -beta, -alpha, depth + 1)
+                node.chosen_succ = child.col
 
         score = max(score, child_score)
         alpha = max(alpha, score)
         if alpha >= beta:
+            record_cutoff(player, child.col, depth)
             break
+    store_score(key, score, alpha_orig, beta, max_depth - depth)
     return score